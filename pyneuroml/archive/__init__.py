@@ -13,7 +13,9 @@ import os
 import pathlib
 import shutil
 import typing
-from zipfile import ZipFile
+from xml.etree import ElementTree
+from xml.sax.saxutils import XMLGenerator
+from zipfile import ZIP_DEFLATED, BadZipFile, ZipFile
 
 from lems.model.model import Model
 from neuroml.loaders import read_neuroml2_file
@@ -38,10 +40,25 @@ STANDARD_LEMS_FILES = [
 ]
 
 
+# COMBINE format identifiers of the files in archives, by file extension
+EXT_TO_FORMAT = {
+    ".nml": "http://identifiers.org/combine.specifications/neuroml",
+    # LEMS simulation files are part of the NeuroML specification
+    ".xml": "http://identifiers.org/combine.specifications/neuroml",
+    ".sedml": "http://identifiers.org/combine.specifications/sed-ml",
+    ".py": "http://purl.org/NET/mediatypes/text/x-python",
+    ".hoc": "http://purl.org/NET/mediatypes/text/plain",
+    ".mod": "http://purl.org/NET/mediatypes/text/plain",
+    ".txt": "http://purl.org/NET/mediatypes/text/plain",
+}  # type: typing.Dict[str, str]
+DEFAULT_FORMAT = "http://purl.org/NET/mediatypes/application/octet-stream"
+
+
 DEFAULTS = {
     "zipfileName": None,
     "zipfileExtension": ".neux",
     "filelist": [],
+    "force": False,
 }  # type: typing.Dict[str, typing.Any]
 
 
@@ -81,6 +98,12 @@ def process_args():
         default=DEFAULTS["filelist"],
         help="Explicit list of files to create archive of.",
     )
+    parser.add_argument(
+        "-force",
+        action="store_true",
+        default=DEFAULTS["force"],
+        help="Regenerate the manifest and archive even if they are up to date.",
+    )
 
     return parser.parse_args()
 
@@ -101,6 +124,7 @@ def cli(a: typing.Optional[typing.Any] = None, **kwargs: str):
         rootfile=a.rootfile,
         zipfile_extension=a.zipfile_extension,
         filelist=a.filelist,
+        force=a.force,
     )
 
 
@@ -109,6 +133,7 @@ def get_model_file_list(
     filelist: typing.List[str],
     rootdir: str = ".",
     lems_def_dir: typing.Optional[str] = None,
+    _seen: typing.Optional[typing.Set[str]] = None,
 ) -> typing.Optional[str]:
     """Get the list of files to archive.
 
@@ -123,6 +148,9 @@ def get_model_file_list(
     :type rootdir: str
     :param lems_def_dir: path to directory holding lems definition files
     :type lems_def_dir: str
+    :param _seen: real paths of files already processed, used internally so
+        that files included more than once are only resolved once
+    :type _seen: set of strings
     :returns: value of lems_def_dir so that the temporary directory can be
         cleaned up. strings are immuatable in Python so the variable cannot be
         modified in the function.
@@ -130,33 +158,38 @@ def get_model_file_list(
     """
     logger.debug(f"Processing {rootfile}")
 
-    fullrootdir = pathlib.Path(rootdir).absolute()
+    fullrootdir = str(pathlib.Path(rootdir).absolute())
 
     # Only store path of file relative to the rootdir, if it's a descendent of
     # rootdir
-    if rootfile.startswith(str(fullrootdir)):
-        relrootfile = rootfile.replace(str(fullrootdir), "")
+    if rootfile.startswith(fullrootdir):
+        relrootfile = rootfile.replace(fullrootdir, "")
         if relrootfile.startswith("/"):
             relrootfile = relrootfile[1:]
     else:
         relrootfile = rootfile
 
-    if relrootfile in filelist:
+    # os.path.join returns rootfile unchanged if it is already absolute
+    fullrootfilepath = os.path.join(rootdir, rootfile)
+
+    if _seen is None:
+        _seen = {os.path.realpath(os.path.join(rootdir, f)) for f in filelist}
+
+    realrootfilepath = os.path.realpath(fullrootfilepath)
+    if realrootfilepath in _seen:
         logger.debug(f"Already processed {rootfile}. No op.")
         return lems_def_dir
+    _seen.add(realrootfilepath)
 
     logger.debug(f"Appending: {relrootfile}")
     filelist.append(relrootfile)
 
     if rootfile.endswith(".nml"):
-        if pathlib.Path(rootfile).is_absolute():
-            rootdoc = read_neuroml2_file(rootfile)
-        else:
-            rootdoc = read_neuroml2_file(rootdir + "/" + rootfile)
+        rootdoc = read_neuroml2_file(fullrootfilepath)
         logger.debug(f"Has includes: {rootdoc.includes}")
         for inc in rootdoc.includes:
             lems_def_dir = get_model_file_list(
-                inc.href, filelist, rootdir, lems_def_dir
+                inc.href, filelist, rootdir, lems_def_dir, _seen
             )
 
     elif rootfile.endswith(".xml"):
@@ -165,11 +198,6 @@ def get_model_file_list(
         if lems_def_dir is None:
             lems_def_dir = extract_lems_definition_files()
 
-        if pathlib.Path(rootfile).is_absolute():
-            fullrootfilepath = rootfile
-        else:
-            fullrootfilepath = rootdir + "/" + rootfile
-
         model = Model(include_includes=True, fail_on_missing_includes=True)
         model.add_include_directory(lems_def_dir)
         model.import_from_file(fullrootfilepath)
@@ -180,7 +208,9 @@ def get_model_file_list(
             if incfile in STANDARD_LEMS_FILES:
                 logger.debug(f"Ignoring NeuroML2 standard LEMS file: {inc}")
                 continue
-            lems_def_dir = get_model_file_list(inc, filelist, rootdir, lems_def_dir)
+            lems_def_dir = get_model_file_list(
+                inc, filelist, rootdir, lems_def_dir, _seen
+            )
 
     else:
         raise ValueError(f"File must have a .xml or .nml extension. We got: {rootfile}")
@@ -193,6 +223,7 @@ def create_combine_archive(
     zipfile_name: typing.Optional[str] = None,
     zipfile_extension=".neux",
     filelist: typing.List[str] = [],
+    force: bool = False,
 ):
     """Create a combine archive that includes all files referred to (included
     recursively) by the provided rootfile.  If a file list is provided, it will
@@ -201,6 +232,10 @@ def create_combine_archive(
 
     All file paths must be relative to the provided rootfile.
 
+    The manifest and archive are not regenerated if they already exist, list
+    the same files, and are newer than all the files they include, unless
+    `force` is set.
+
     For more information, see:
 
     Bergmann, F.T., Adams, R., Moodie, S. et al. COMBINE archive and OMEX
@@ -216,6 +251,8 @@ def create_combine_archive(
     :type zipfile_extension: str
     :param filelist: explicit list of files to create archive of
     :type filelist: list of strings
+    :param force: regenerate the manifest and archive even if up to date
+    :type force: bool
     :returns: None
     :raises ValueError: if a root file is not provided
     """
@@ -241,80 +278,158 @@ def create_combine_archive(
     if len(filelist) == 0:
         lems_def_dir = get_model_file_list(rootfile, filelist, rootdir, lems_def_dir)
 
-    create_combine_archive_manifest(rootfile, filelist, rootdir)
+    create_combine_archive_manifest(rootfile, filelist, rootdir, force)
     filelist.append("manifest.xml")
 
-    # change to directory of rootfile
-    thispath = os.getcwd()
-    os.chdir(rootdir)
-
-    with ZipFile(zipfile_name + zipfile_extension, "w") as archive:
-        for f in filelist:
-            archive.write(f)
-    os.chdir(thispath)
+    archive_path = os.path.join(rootdir, zipfile_name + zipfile_extension)
+    if (
+        not force
+        and _is_up_to_date(archive_path, [os.path.join(rootdir, f) for f in filelist])
+        and _archive_lists(archive_path, filelist)
+    ):
+        logger.info(f"Archive {archive_path} is up to date. Not regenerating.")
+    else:
+        # change to directory of rootfile
+        thispath = os.getcwd()
+        os.chdir(rootdir)
+
+        # files are streamed from disk one at a time by ZipFile.write; a low
+        # compression level is sufficient for the XML files that make up
+        # models. A larger write buffer batches the many small header writes.
+        with open(
+            zipfile_name + zipfile_extension, "wb", buffering=65536
+        ) as zf, ZipFile(
+            zf,
+            "w",
+            compression=ZIP_DEFLATED,
+            compresslevel=1,
+            allowZip64=True,
+        ) as archive:
+            for f in filelist:
+                archive.write(f)
+        os.chdir(thispath)
+
+        logger.info(
+            f"Archive {rootdir}/{zipfile_name}{zipfile_extension} created with manifest file {rootdir}/manifest.xml."
+        )
 
     if lems_def_dir is not None:
         logger.info(f"Removing LEMS definitions directory {lems_def_dir}")
         shutil.rmtree(lems_def_dir)
 
-    logger.info(
-        f"Archive {rootdir}/{zipfile_name}{zipfile_extension} created with manifest file {rootdir}/manifest.xml."
-    )
-
 
 def create_combine_archive_manifest(
-    rootfile: str, filelist: typing.List[str], rootdir: str = "."
+    rootfile: str,
+    filelist: typing.List[str],
+    rootdir: str = ".",
+    force: bool = False,
 ):
     """Create a combine archive manifest file called manifest.xml
 
+    The manifest is not regenerated if it already exists, lists the same
+    files, and is newer than all of them, unless `force` is set.
+
     :param rootfile: the root file for this archive; marked as "master"
     :type rootfile: str
     :param filelist: list of files to be included in the manifest
     :type filelist: list of strings
     :param rootdir: directory where root file lives
     :type rootdir: str
+    :param force: regenerate the manifest even if it is up to date
+    :type force: bool
     """
     manifest = rootdir + "/manifest.xml"
-    with open(manifest, "w") as mf:
-        print('<?xml version="1.0" encoding="utf-8"?>', file=mf)
-        print(
-            """
-            <omexManifest
-            xmlns="http://identifiers.org/combine.specifications/omex-manifest">
-            """,
-            file=mf,
+    contents = [
+        {
+            "location": ".",
+            "format": "http://identifiers.org/combine.specifications/omex",
+        }
+    ]
+    for f in filelist:
+        content = {
+            "location": f,
+            "format": EXT_TO_FORMAT.get(pathlib.PurePath(f).suffix, DEFAULT_FORMAT),
+        }
+        if f == rootfile:
+            content["master"] = "true"
+        contents.append(content)
+
+    if (
+        not force
+        and _is_up_to_date(manifest, [os.path.join(rootdir, f) for f in filelist])
+        and _manifest_lists(manifest, contents)
+    ):
+        logger.info(f"Manifest {manifest} is up to date. Not regenerating.")
+        return
+
+    # stream the elements to the file rather than building a document tree
+    with open(manifest, "wb") as mf:
+        gen = XMLGenerator(mf, encoding="utf-8", short_empty_elements=True)
+        gen.startDocument()
+        gen.startElement(
+            "omexManifest",
+            {"xmlns": "http://identifiers.org/combine.specifications/omex-manifest"},
         )
 
-        print(
-            """
-            <content location="."
-                format="http://identifiers.org/combine.specifications/omex"/>
-            """,
-            file=mf,
-        )
+        for content in contents:
+            gen.ignorableWhitespace("\n    ")
+            gen.startElement("content", content)
+            gen.endElement("content")
 
-        for f in filelist:
-            if f == rootfile:
-                print(
-                    f"""
-                    <content location="{f}" master="true"
-                        format="http://identifiers.org/combine.specifications/neuroml"/>
-                    """,
-                    file=mf,
-                )
-            else:
-                print(
-                    f"""
-                    <content location="{f}"
-                        format="http://identifiers.org/combine.specifications/neuroml"/>
-                    """,
-                    file=mf,
-                )
-
-        print(
-            """
-            </omexManifest>
-            """,
-            file=mf,
-            flush=True,
-        )
+        gen.ignorableWhitespace("\n")
+        gen.endElement("omexManifest")
+        gen.ignorableWhitespace("\n")
+        gen.endDocument()
+
+
+def _is_up_to_date(output: str, inputs: typing.List[str]) -> bool:
+    """Check if a generated file exists and is newer than all its inputs.
+
+    Inputs with the same modification time as the generated file are taken to
+    be newer, since on file systems with coarse timestamps they may have been
+    modified after it was generated.
+
+    :param output: path of generated file
+    :type output: str
+    :param inputs: paths of files that the generated file is made from
+    :type inputs: list of strings
+    :returns: True if the generated file is up to date, False otherwise
+    """
+    try:
+        output_mtime = os.stat(output).st_mtime_ns
+        return all(os.stat(f).st_mtime_ns < output_mtime for f in inputs)
+    except FileNotFoundError:
+        return False
+
+
+def _manifest_lists(manifest: str, contents: typing.List[typing.Dict[str, str]]):
+    """Check if an existing manifest file has exactly the provided contents.
+
+    :param manifest: path of manifest file
+    :type manifest: str
+    :param contents: attributes of the expected content elements
+    :type contents: list of dicts
+    :returns: True if the manifest has the same contents, False otherwise
+    """
+    try:
+        root = ElementTree.parse(manifest).getroot()
+    except (OSError, ElementTree.ParseError):
+        return False
+    ns = "{http://identifiers.org/combine.specifications/omex-manifest}"
+    return [dict(c.attrib) for c in root.iter(ns + "content")] == contents
+
+
+def _archive_lists(archive: str, filelist: typing.List[str]) -> bool:
+    """Check if an existing archive holds exactly the provided files.
+
+    :param archive: path of archive file
+    :type archive: str
+    :param filelist: paths of files, relative to the archive
+    :type filelist: list of strings
+    :returns: True if the archive holds the same files, False otherwise
+    """
+    try:
+        with ZipFile(archive) as zf:
+            return zf.namelist() == filelist
+    except (OSError, BadZipFile):
+        return False
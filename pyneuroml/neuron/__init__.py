@@ -7,6 +7,7 @@ Will use some some utilities from https://github.com/OpenSourceBrain/NEURONShowc
 """
 
 import os
+import functools
 import logging
 import warnings
 import typing
@@ -33,7 +34,11 @@ pp = pprint.PrettyPrinter(depth=4)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# whether utils.hoc has been loaded by _load_utils_hoc
+_utils_hoc_loaded = False
 
+
+@functools.lru_cache(maxsize=None)
 def get_utils_hoc() -> pathlib.Path:
     """Get full path of utils.hoc file
 
@@ -45,6 +50,20 @@ def get_utils_hoc() -> pathlib.Path:
     return utils_hoc
 
 
+def _load_utils_hoc() -> bool:
+    """Load the utils.hoc file, unless it has already been loaded.
+
+    The file only declares procedures and object variables, so it does not
+    need to be re-run each time one of them is used.
+
+    :returns: True if the file is loaded, False if an error occurred
+    """
+    global _utils_hoc_loaded
+    if not _utils_hoc_loaded:
+        _utils_hoc_loaded = load_hoc_or_python_file(str(get_utils_hoc().absolute()))
+    return _utils_hoc_loaded
+
+
 def export_to_neuroml2(
     hoc_or_python_file: str,
     nml2_file_name: str,
@@ -139,15 +158,44 @@ def export_to_neuroml1(hoc_file, nml1_file_name, level=1, validate=True):
         validate_neuroml1(nml1_file_name)
 
 
-def load_hoc_or_python_file(hoc_or_python_file: str) -> bool:
+def load_hoc_or_python_file(
+    hoc_or_python_file: typing.Optional[str] = None,
+    source: typing.Optional[str] = None,
+) -> bool:
     """Load a NEURON hoc file or Python script.
 
+    Hoc code can also be provided directly as a string using `source`, in
+    which case it is executed without reading any file.
+
     Note: loading Python scripts is not yet supported.
 
     :param hoc_or_python_file: NEURON hoc or Python file to convert
     :type hoc_or_python_file: str
+    :param source: hoc code to execute instead of loading a file
+    :type source: str
     :returns: True if file was loaded, False if an error occurred
+    :raises ValueError: if neither or both of a file and source are provided
     """
+    if hoc_or_python_file is not None and source is not None:
+        raise ValueError(
+            "Please provide either a hoc or Python file, or hoc source, not both."
+        )
+
+    if source is not None:
+        try:
+            resp = h(source)
+        except RuntimeError as e:
+            logger.error(f"Error while executing hoc source:\n{e}")
+            return False
+        if not resp:
+            logger.error("Error while executing hoc source")
+            return False
+        logger.info("Executed hoc source")
+        return True
+
+    if hoc_or_python_file is None:
+        raise ValueError("Please provide a hoc or Python file, or hoc source.")
+
     if hoc_or_python_file.endswith(".py"):
         logger.info(
             "***************\nImporting Python scripts not yet implemented...\n***************"
@@ -160,9 +208,15 @@ def load_hoc_or_python_file(hoc_or_python_file: str) -> bool:
                 % (hoc_or_python_file, os.path.abspath(hoc_or_python_file))
             )
             return False
-        resp = h.load_file(
-            1, hoc_or_python_file
-        )  # Using 1 to force loading of the file, in case file with same name was loaded before...
+
+        try:
+            resp = h.load_file(
+                1, hoc_or_python_file
+            )  # Using 1 to force loading of the file, in case file with same name was loaded before...
+        except RuntimeError as e:
+            # newer versions of NEURON raise an error instead of returning 0
+            logger.error(f"Error while loading {hoc_or_python_file}:\n{e}")
+            return False
         # returns 1.0 if loads fine, 0.0 if error
         if int(resp) == 0:
             logger.error(f"Error while loading {hoc_or_python_file}:\n{resp}")
@@ -187,7 +241,7 @@ def morphinfohoc(section: typing.Optional[str] = None) -> None:
         FutureWarning,
         stacklevel=2,
     )
-    retval = load_hoc_or_python_file(str(get_utils_hoc().absolute()))
+    retval = _load_utils_hoc()
     if retval is True:
         if section:
             h(f"access {section}")
@@ -196,7 +250,10 @@ def morphinfohoc(section: typing.Optional[str] = None) -> None:
         logger.error("Could not run morph(). Error loading utils hoc")
 
 
-def morphinfo(section: typing.Optional[str] = None, doprint: str = "") -> dict:
+def morphinfo(
+    section: typing.Optional[str] = None,
+    doprint: typing.Optional[str] = "",
+) -> dict:
     """Provides morphology of the provided section.
 
     Returns a dictionary, and also prints out the information in yaml or json.
@@ -205,7 +262,7 @@ def morphinfo(section: typing.Optional[str] = None, doprint: str = "") -> dict:
     :type section: str or None
     :param doprint: toggle printing to std output and its format.
         Use "json" or "yaml" to print in the required format, any other value
-        to disable printing.
+        (such as None) to disable printing.
     :type doprint: str
     :returns: morphology information dict
     """
@@ -226,21 +283,25 @@ def morphinfo(section: typing.Optional[str] = None, doprint: str = "") -> dict:
     totalarea = 0
     lastx = lasty = lastz = 0
     for i in range(cas.n3d()):
-        delx = cas.x3d(i) - lastx
-        dely = cas.y3d(i) - lasty
-        delz = cas.z3d(i) - lastz
+        # query each coordinate from hoc only once
+        x = cas.x3d(i)
+        y = cas.y3d(i)
+        z = cas.z3d(i)
+        delx = x - lastx
+        dely = y - lasty
+        delz = z - lastz
         length = math.sqrt((delx * delx) + (dely * dely) + (delz * delz))
         if i == 0:
             delx = dely = delz = length = 0
 
-        lastx = cas.x3d(i)
-        lasty = cas.y3d(i)
-        lastz = cas.z3d(i)
+        lastx = x
+        lasty = y
+        lastz = z
 
         sectiondict["3d points"][i] = {
-            "x": cas.x3d(i),
-            "y": cas.y3d(i),
-            "z": cas.z3d(i),
+            "x": x,
+            "y": y,
+            "z": z,
             "diam": cas.diam3d(i),
             "delx": delx,
             "dely": dely,
@@ -249,22 +310,25 @@ def morphinfo(section: typing.Optional[str] = None, doprint: str = "") -> dict:
         }
 
     for i in range(cas.nseg + 2):
-        sectiondict["segments"][float(i / (cas.nseg + 1))] = {
-            "diam": cas(i / (cas.nseg + 1)).diam,
-            "area": str(h.area(i / (cas.nseg + 1))) + " um^2",
+        loc = i / (cas.nseg + 1)
+        area = h.area(loc)
+        sectiondict["segments"][float(loc)] = {
+            "diam": cas(loc).diam,
+            "area": str(area) + " um^2",
         }
-        totalarea = totalarea + h.area(i / (cas.nseg + 1))
+        totalarea = totalarea + area
 
     sectiondict["totalarea"] = totalarea
 
+    # serialise only once, and only if printing was requested
     if doprint == "yaml":
-        logger.info(yaml.dump(sectiondict, sort_keys=True, indent=4))
-        if doprint:
-            print(yaml.dump(sectiondict, sort_keys=True, indent=4))
+        formatted = yaml.dump(sectiondict, sort_keys=True, indent=4)
+        logger.info(formatted)
+        print(formatted)
     elif doprint == "json":
-        logger.info(json.dumps(sectiondict, indent=4, sort_keys=True))
-        if doprint:
-            print(json.dumps(sectiondict, indent=4, sort_keys=True))
+        formatted = json.dumps(sectiondict, indent=4, sort_keys=True)
+        logger.info(formatted)
+        print(formatted)
 
     return sectiondict
 
@@ -281,21 +345,21 @@ def cellinfohoc() -> None:
         FutureWarning,
         stacklevel=2,
     )
-    retval = load_hoc_or_python_file(str(get_utils_hoc().absolute()))
+    retval = _load_utils_hoc()
     if retval is True:
         h("cellInfo()")
     else:
         logger.error("Could not run cellInfo(). Error loading utils hoc")
 
 
-def cellinfo(doprint: str = "") -> dict:
+def cellinfo(doprint: typing.Optional[str] = "") -> dict:
     """Provide summary information on the current cell.
 
     Returns a dictionary, and also prints out the information in yaml or json.
 
     :param doprint: toggle printing to std output and its format.
         Use "json" or "yaml" to print in the required format, any other value
-        to disable printing.
+        (such as None) to disable printing.
     :type doprint: str
     :returns: cellinfo dict
     """
@@ -312,19 +376,35 @@ def cellinfo(doprint: str = "") -> dict:
     return getinfo(seclist, doprint)
 
 
-def getinfo(seclist: list, doprint: str = "", listall: bool = False):
+def getinfo(
+    seclist: list,
+    doprint: typing.Optional[str] = "",
+    listall: bool = False,
+    layout: str = "nested",
+):
     """Provide detailed information on the provided section list.
 
     Returns a dictionary, and also prints out the information in yaml or json.
 
+    With the "flat" layout, only the mechanism parameter values are returned,
+    in a dictionary keyed by (mechanism, parameter, section, segment) tuples.
+    The segment is "*" if the parameter has the same value on all segments of
+    the section. Printing always uses the nested layout.
+
     :param doprint: toggle printing to std output and its format.
         Use "json" or "yaml" to print in the required format, any other value
-        to disable printing.
+        (such as None) to disable printing.
     :type doprint: str
     :param listall: also list mechs that are not present on any sections
     :type listall: bool
+    :param layout: "nested" (default) or "flat"
+    :type layout: str
     :returns: dict
+    :raises ValueError: if an unknown layout is requested
     """
+    if layout not in ["nested", "flat"]:
+        raise ValueError(f"Layout must be 'nested' or 'flat'. We got: {layout}")
+
     totalDiam = 0
     totalNseg = 0
     totalL = 0
@@ -439,14 +519,17 @@ def getinfo(seclist: list, doprint: str = "", listall: bool = False):
         ms = h.MechanismStandard(mname, 1)
         numParams = ms.count()
 
-        # construct empty dicts to hold information
-        totParamVal = {}
-        paramsectiondict = {}  # type: dict[typing.Any, typing.Any]
+        # get the parameter names only once: each query is a call into hoc
+        param_names = []
         for j in range(numParams):
             # assign pname the name of the jth parameter
             ms.name(pname, j)
-            totParamVal[j] = 0
-            paramsectiondict[rm_NML_str(pname[0])] = {}
+            param_names.append(pname[0])
+        param_keys = [rm_NML_str(pn) for pn in param_names]
+
+        # construct empty dicts to hold information
+        totParamVal = [0.0] * numParams
+        paramsectiondict = {pk: {} for pk in param_keys}  # type: dict[typing.Any, typing.Any]
 
         numSecPresent = 0
         numSegsPresent = 0
@@ -454,6 +537,11 @@ def getinfo(seclist: list, doprint: str = "", listall: bool = False):
             if h.ismembrane(mname, sec=sec):
                 numSecPresent += 1
                 numSegsPresent += sec.nseg
+                secname = replace_brackets(str(sec))
+                for pk in param_keys:
+                    if secname not in paramsectiondict[pk]:
+                        paramsectiondict[pk][secname] = {"id": str(sec)}
+
                 # segment information is provided as a fraction of the total
                 # section length, not the segment list
                 seginfo = {}  # type: dict[typing.Any, typing.Any]
@@ -463,40 +551,30 @@ def getinfo(seclist: list, doprint: str = "", listall: bool = False):
                     logger.debug(f"section {sec}: {seg}/{sec.nseg}: {mid_pt}")
                     ms._in(mid_pt, sec=sec)
                     for j in range(numParams):
-                        ms.name(pname, j)
-                        totParamVal[j] += ms.get(pname)
-                        if (
-                            not replace_brackets(str(sec))
-                            in paramsectiondict[rm_NML_str(pname[0])].keys()
-                        ):
-                            paramsectiondict[rm_NML_str(pname[0])][
-                                replace_brackets(str(sec))
-                            ] = {
-                                "id": str(sec),
-                            }
-                        if rm_NML_str(pname[0]) in seginfo[seg]:
-                            logger.warning(f"{pname[0]} already exists in {seg}")
-                        seginfo[seg][rm_NML_str(pname[0])] = ms.get(pname)
-
-                for j in range(numParams):
-                    ms.name(pname, j)
+                        value = ms.get(param_names[j])
+                        totParamVal[j] += value
+                        if param_keys[j] in seginfo[seg]:
+                            logger.warning(f"{param_names[j]} already exists in {seg}")
+                        seginfo[seg][param_keys[j]] = value
+
+                for pk in param_keys:
                     newseginfo = {}
                     for seg, value in seginfo.items():
-                        if rm_NML_str(pname[0]) in value:
-                            newseginfo[seg] = value[rm_NML_str(pname[0])]
-                            logger.debug(f"{seg}: {value[rm_NML_str(pname[0])]}")
+                        if pk in value:
+                            newseginfo[seg] = value[pk]
+                            logger.debug(f"{seg}: {value[pk]}")
 
                     values = list(newseginfo.values())
                     unique_values = list(set(values))
                     # if all values are the same, only print them once as '*'
                     if len(unique_values) == 1:
-                        paramsectiondict[rm_NML_str(pname[0])][
-                            replace_brackets(str(sec))
-                        ].update({"nseg": sec.nseg, "values": {"*": unique_values[0]}})
+                        paramsectiondict[pk][secname].update(
+                            {"nseg": sec.nseg, "values": {"*": unique_values[0]}}
+                        )
                     else:
-                        paramsectiondict[rm_NML_str(pname[0])][
-                            replace_brackets(str(sec))
-                        ].update({"nseg": sec.nseg, "values": newseginfo})
+                        paramsectiondict[pk][secname].update(
+                            {"nseg": sec.nseg, "values": newseginfo}
+                        )
 
         if listall or numSecPresent > 0:
             mt_dict = {
@@ -506,30 +584,52 @@ def getinfo(seclist: list, doprint: str = "", listall: bool = False):
             }
 
             for j in range(numParams):
-                ms.name(pname, j)
                 try:
                     param_dict = {
                         "ave_all_segs": totParamVal[j] / numSegsPresent,
-                        "values": paramsectiondict[rm_NML_str(pname[0])],
+                        "values": paramsectiondict[param_keys[j]],
                     }
                 except ZeroDivisionError:
                     param_dict = {"ave_all_sections": "NA", "values": "NA"}
 
-                mt_dict["parameters"][rm_NML_str(pname[0])] = param_dict
+                mt_dict["parameters"][param_keys[j]] = param_dict
             infodict["mechanisms"][rm_NML_str(mname[0])] = mt_dict
 
+    # serialise only once, and only if printing was requested
     if doprint == "yaml":
-        logger.info(yaml.dump(infodict, sort_keys=True, indent=4))
-        if doprint:
-            print(yaml.dump(infodict, sort_keys=True, indent=4))
+        formatted = yaml.dump(infodict, sort_keys=True, indent=4)
+        logger.info(formatted)
+        print(formatted)
     elif doprint == "json":
-        logger.info(json.dumps(infodict, indent=4, sort_keys=True))
-        if doprint:
-            print(json.dumps(infodict, indent=4, sort_keys=True))
+        formatted = json.dumps(infodict, indent=4, sort_keys=True)
+        logger.info(formatted)
+        print(formatted)
+
+    if layout == "flat":
+        return flatten_mechanism_info(infodict)
 
     return infodict
 
 
+def flatten_mechanism_info(infodict: dict) -> dict:
+    """Flatten the mechanism parameter values of a `getinfo` dictionary.
+
+    :param infodict: dictionary returned by `getinfo`
+    :type infodict: dict
+    :returns: dict of values keyed by (mechanism, parameter, section, segment)
+    """
+    flatinfo = {}  # type: typing.Dict[typing.Tuple[str, str, str, typing.Any], float]
+    for mech, mech_dict in infodict["mechanisms"].items():
+        for param, param_dict in mech_dict["parameters"].items():
+            # "NA" if the mechanism is not present on any section
+            if not isinstance(param_dict["values"], dict):
+                continue
+            for sec, sec_dict in param_dict["values"].items():
+                for seg, value in sec_dict["values"].items():
+                    flatinfo[(mech, param, sec, seg)] = value
+    return flatinfo
+
+
 def secinfohoc(section: str = "") -> None:
     """Provide information on current section, like an expanded `psection()`.
     Uses the hoc utility function. Please prefer the `cellinfo` function
@@ -541,7 +641,7 @@ def secinfohoc(section: str = "") -> None:
         FutureWarning,
         stacklevel=2,
     )
-    retval = load_hoc_or_python_file(str(get_utils_hoc().absolute()))
+    retval = _load_utils_hoc()
     if retval is True:
         if section:
             h(f"access {section}")
@@ -550,7 +650,7 @@ def secinfohoc(section: str = "") -> None:
         logger.error("Could not run secinfo(). Error loading utils hoc")
 
 
-def secinfo(section: str = "", doprint: str = "json"):
+def secinfo(section: str = "", doprint: typing.Optional[str] = "json"):
     """Print summary information on provided section, like an expanded
     `psection()`:
 
@@ -570,7 +670,7 @@ def secinfo(section: str = "", doprint: str = "json"):
     :type section: str
     :param doprint: toggle printing to std output and its format.
         Use "json" or "yaml" to print in the required format, any other value
-        to disable printing.
+        (such as None) to disable printing.
     :type doprint: str
     :returns: section information dict
 
@@ -611,14 +711,15 @@ def secinfo(section: str = "", doprint: str = "json"):
     sectiondict["total area"] = total_area
     sectiondict["total ri"] = str(total_ri * 1e3) + " ohm"
 
+    # serialise only once, and only if printing was requested
     if doprint == "yaml":
-        logger.info(yaml.dump(sectiondict, sort_keys=True, indent=4))
-        if doprint:
-            print(yaml.dump(sectiondict, sort_keys=True, indent=4))
+        formatted = yaml.dump(sectiondict, sort_keys=True, indent=4)
+        logger.info(formatted)
+        print(formatted)
     elif doprint == "json":
-        logger.info(json.dumps(sectiondict, indent=4, sort_keys=True))
-        if doprint:
-            print(json.dumps(sectiondict, indent=4, sort_keys=True))
+        formatted = json.dumps(sectiondict, indent=4, sort_keys=True)
+        logger.info(formatted)
+        print(formatted)
 
     return sectiondict
 
@@ -633,7 +734,7 @@ def areainfo() -> None:
     - summary metrics for the whole cell
 
     """
-    retval = load_hoc_or_python_file(str(get_utils_hoc().absolute()))
+    retval = _load_utils_hoc()
     if retval is True:
         h("areainfo()")
     else:
@@ -642,7 +743,7 @@ def areainfo() -> None:
 
 def allv() -> None:
     """Prints voltage of all compartments (segments)."""
-    retval = load_hoc_or_python_file(str(get_utils_hoc().absolute()))
+    retval = _load_utils_hoc()
     if retval is True:
         h("allv()")
     else:
@@ -651,7 +752,7 @@ def allv() -> None:
 
 def allca() -> None:
     """Prints Ca conc of all compartments (segments)."""
-    retval = load_hoc_or_python_file(str(get_utils_hoc().absolute()))
+    retval = _load_utils_hoc()
     if retval is True:
         h("allca()")
     else:
@@ -665,7 +766,7 @@ def allsyns(var: str) -> None:
     :param var: name of NEURON variable holding cells to get information for
     :type var: str
     """
-    retval = load_hoc_or_python_file(str(get_utils_hoc().absolute()))
+    retval = _load_utils_hoc()
     if retval is True:
         h(f"allCells = {var}")
         h("allsyns()")
@@ -679,7 +780,7 @@ def allcells(var: str) -> None:
     :param var: name of NEURON variable holding cells to get information for
     :type var: str
     """
-    retval = load_hoc_or_python_file(str(get_utils_hoc().absolute()))
+    retval = _load_utils_hoc()
     if retval is True:
         h(f"allCells = {var}")
         h("allcells()")
@@ -9,10 +9,18 @@ Copyright 2023 NeuroML contributors
 
 
 import logging
+import os
 import pathlib
+import shutil
+import tempfile
+import typing
 import unittest
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
 from pyneuroml.archive import (
+    DEFAULT_FORMAT,
+    EXT_TO_FORMAT,
     create_combine_archive,
     create_combine_archive_manifest,
     get_model_file_list,
@@ -21,98 +29,229 @@ from pyneuroml.archive import (
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+_HERE = pathlib.Path(__file__).resolve().parent
+_TESTS_DIR = str(_HERE.parent)
+_EXAMPLES_DIR = str(_HERE.parent.parent / "examples")
+_OMEX_NS = "{http://identifiers.org/combine.specifications/omex-manifest}"
+
 
 class TestArchiveModule(unittest.TestCase):
 
     """Test the pyneuroml.archive module."""
 
+    @classmethod
+    def setUpClass(cls):
+        """Resolve the file lists of the test models once for all tests."""
+        cases = [
+            # a NeuroML file in the tests directory
+            ("HH_example_cell.nml", _TESTS_DIR),
+            # a LEMS file in the examples directory
+            ("LEMS_NML2_Ex5_DetCell.xml", _EXAMPLES_DIR),
+            # NeuroML file in examples directory
+            ("NML2_SingleCompHHCell.nml", _EXAMPLES_DIR),
+        ]
+
+        def resolve(case: typing.Tuple[str, str]) -> typing.List[str]:
+            model, dirname = case
+            filelist = []  # type: typing.List[str]
+            lems_def_dir = get_model_file_list(model, filelist, dirname)
+            if lems_def_dir is not None:
+                shutil.rmtree(lems_def_dir)
+            return filelist
+
+        # the models are independent, so they can be resolved concurrently
+        with ThreadPoolExecutor(max_workers=len(cases)) as ex:
+            cls._filelists = dict(zip(cases, ex.map(resolve, cases)))
+
     def test_get_model_file_list(self):
         """Test get_model_file_list."""
-        # a NeuroML file in the tests directory
-        thispath = pathlib.Path(__file__)
-        dirname = str(thispath.parent.parent)
-        filelist = []
-        get_model_file_list("HH_example_cell.nml", filelist, dirname)
-        self.assertEqual(4, len(filelist))
+        for case, numfiles in [
+            # a NeuroML file in the tests directory
+            (("HH_example_cell.nml", _TESTS_DIR), 4),
+            # a LEMS file in the examples directory
+            (("LEMS_NML2_Ex5_DetCell.xml", _EXAMPLES_DIR), 5),
+            # NeuroML file in examples directory
+            (("NML2_SingleCompHHCell.nml", _EXAMPLES_DIR), 4),
+        ]:
+            with self.subTest(case=case):
+                filelist = list(self._filelists[case])
+                self.assertEqual(numfiles, len(filelist))
 
-        # a LEMS file in the examples directory
-        dirname = str(thispath.parent.parent.parent)
-        filelist = []
-        get_model_file_list(
-            "LEMS_NML2_Ex5_DetCell.xml", filelist, dirname + "/examples"
-        )
-        self.assertEqual(5, len(filelist))
+    def test_get_model_file_list_existing(self):
+        """Test that files already in the list are not added again."""
+        # the root file, under a different path
+        filelist = ["./HH_example_cell.nml"]
+        lems_def_dir = get_model_file_list("HH_example_cell.nml", filelist, _TESTS_DIR)
+        if lems_def_dir is not None:
+            shutil.rmtree(lems_def_dir)
+        self.assertEqual(["./HH_example_cell.nml"], filelist)
 
-        # NeuroML file in examples directory
-        dirname = str(thispath.parent.parent.parent)
-        filelist = []
-        get_model_file_list(
-            "NML2_SingleCompHHCell.nml", filelist, dirname + "/examples"
-        )
+        # an included file, under a different path
+        included = [
+            f
+            for f in self._filelists[("HH_example_cell.nml", _TESTS_DIR)]
+            if f != "HH_example_cell.nml"
+        ][0]
+        filelist = ["./" + included]
+        lems_def_dir = get_model_file_list("HH_example_cell.nml", filelist, _TESTS_DIR)
+        if lems_def_dir is not None:
+            shutil.rmtree(lems_def_dir)
         self.assertEqual(4, len(filelist))
+        self.assertNotIn(included, filelist)
+
+    def _copy_model(self, case: typing.Tuple[str, str], destdir: str) -> None:
+        """Copy the files of a model to a scratch directory.
+
+        :param case: (model file, directory) tuple that was resolved
+        :type case: tuple of strings
+        :param destdir: directory to copy the files to
+        :type destdir: str
+        """
+        srcdir = pathlib.Path(case[1])
+        for f in self._filelists[case]:
+            dest = pathlib.Path(destdir) / f
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(srcdir / f, dest)
 
     def test_create_combine_archive_manifest(self):
         """Test create_combine_archive_manifest function."""
-        thispath = pathlib.Path(__file__)
-        dirname = str(thispath.parent.parent)
-        filelist = []
-        get_model_file_list("HH_example_cell.nml", filelist, dirname)
-        create_combine_archive_manifest("HH_example_cell.nml", filelist, dirname)
-        self.assertTrue(pathlib.Path(dirname + "/manifest.xml").exists())
+        # a NeuroML file in the tests directory
+        with tempfile.TemporaryDirectory() as td:
+            filelist = list(self._filelists[("HH_example_cell.nml", _TESTS_DIR)])
+            # a file of a format that is not known
+            filelist.append("notes.dat")
+            # a name that must be escaped in XML
+            filelist.append("a&b <c>.txt")
+            create_combine_archive_manifest("HH_example_cell.nml", filelist, td)
+            self.assertTrue(pathlib.Path(td, "manifest.xml").exists())
+
+            contents = {
+                c.get("location"): c
+                for c in ET.parse(pathlib.Path(td, "manifest.xml")).iter(
+                    _OMEX_NS + "content"
+                )
+            }
+            self.assertEqual(len(filelist) + 1, len(contents))
+            self.assertEqual(contents["HH_example_cell.nml"].get("master"), "true")
+            for f in filelist:
+                if f != "HH_example_cell.nml":
+                    self.assertIsNone(contents[f].get("master"))
+                if f.endswith((".nml", ".xml")):
+                    self.assertEqual(
+                        contents[f].get("format"),
+                        "http://identifiers.org/combine.specifications/neuroml",
+                    )
+            self.assertNotIn(".dat", EXT_TO_FORMAT)
+            self.assertEqual(contents["notes.dat"].get("format"), DEFAULT_FORMAT)
+            self.assertIn("a&b <c>.txt", contents)
 
         # a LEMS file in the examples directory
-        dirname = str(thispath.parent.parent.parent)
-        filelist = []
-        get_model_file_list(
-            "LEMS_NML2_Ex5_DetCell.xml", filelist, dirname + "/examples"
-        )
-        create_combine_archive_manifest(
-            "LEMS_NML2_Ex5_DetCell.xml", filelist, dirname + "/examples"
-        )
-        self.assertTrue(pathlib.Path(dirname + "/examples/manifest.xml").exists())
+        with tempfile.TemporaryDirectory() as td:
+            filelist = list(
+                self._filelists[("LEMS_NML2_Ex5_DetCell.xml", _EXAMPLES_DIR)]
+            )
+            create_combine_archive_manifest("LEMS_NML2_Ex5_DetCell.xml", filelist, td)
+            self.assertTrue(pathlib.Path(td, "manifest.xml").exists())
 
         # NeuroML file in examples directory
-        dirname = str(thispath.parent.parent.parent)
-        filelist = []
-        get_model_file_list(
-            "NML2_SingleCompHHCell.nml", filelist, dirname + "/examples"
-        )
-        create_combine_archive_manifest(
-            "NML2_SingleCompHHCell.nml", filelist, dirname + "/examples"
-        )
-        self.assertTrue(pathlib.Path(dirname + "/examples/manifest.xml").exists())
+        with tempfile.TemporaryDirectory() as td:
+            filelist = list(
+                self._filelists[("NML2_SingleCompHHCell.nml", _EXAMPLES_DIR)]
+            )
+            create_combine_archive_manifest("NML2_SingleCompHHCell.nml", filelist, td)
+            self.assertTrue(pathlib.Path(td, "manifest.xml").exists())
 
     def test_create_combine_archive(self):
         """Test create_combine_archive."""
+        with tempfile.TemporaryDirectory() as td:
+            case = ("HH_example_cell.nml", _TESTS_DIR)
+            self._copy_model(case, td)
+            create_combine_archive(
+                zipfile_name="HH_example",
+                rootfile=td + "/HH_example_cell.nml",
+                filelist=[],
+            )
+            self.assertTrue(pathlib.Path(td, "HH_example.neux").exists())
+
+        with tempfile.TemporaryDirectory() as td:
+            case = ("LEMS_NML2_Ex5_DetCell.xml", _EXAMPLES_DIR)
+            self._copy_model(case, td)
+            create_combine_archive(
+                zipfile_name="LEMS_NML2_Ex5_DetCell",
+                rootfile=td + "/LEMS_NML2_Ex5_DetCell.xml",
+                filelist=[],
+            )
+            self.assertTrue(pathlib.Path(td, "LEMS_NML2_Ex5_DetCell.neux").exists())
+
+        with tempfile.TemporaryDirectory() as td:
+            case = ("NML2_SingleCompHHCell.nml", _EXAMPLES_DIR)
+            self._copy_model(case, td)
+            create_combine_archive(
+                zipfile_name="NML2_SingleCompHHCell",
+                rootfile=td + "/NML2_SingleCompHHCell.nml",
+                filelist=[],
+            )
+            self.assertTrue(pathlib.Path(td, "NML2_SingleCompHHCell.neux").exists())
+
+    def test_regeneration(self):
+        """Test that only out of date manifests and archives are regenerated."""
+        # fixed modification times, in ns: inputs are older than outputs
+        input_mtime = 10**18
+        output_mtime = input_mtime + 10**9
+
+        def set_mtime(path: pathlib.Path, mtime: int) -> None:
+            os.utime(path, ns=(mtime, mtime))
+
+        case = ("HH_example_cell.nml", _TESTS_DIR)
+        with tempfile.TemporaryDirectory() as td:
+            self._copy_model(case, td)
+            filelist = list(self._filelists[case])
+            inputs = [pathlib.Path(td, f) for f in filelist]
+            for f in inputs:
+                set_mtime(f, input_mtime)
+
+            # manifest
+            manifest = pathlib.Path(td, "manifest.xml")
+
+            def create_manifest(files, force=False):
+                set_mtime(manifest, output_mtime)
+                create_combine_archive_manifest(
+                    "HH_example_cell.nml", files, td, force=force
+                )
+                return manifest.stat().st_mtime_ns != output_mtime
+
+            create_combine_archive_manifest("HH_example_cell.nml", filelist, td)
+            self.assertFalse(create_manifest(filelist))
+            self.assertTrue(create_manifest(filelist, force=True))
+            self.assertTrue(create_manifest(filelist[:-1]))
+            self.assertTrue(create_manifest(filelist))
+            os.utime(inputs[-1])
+            self.assertTrue(create_manifest(filelist))
+            set_mtime(inputs[-1], input_mtime)
+
+            # archive, which also includes the manifest
+            archive = pathlib.Path(td, "HH_example.neux")
+
+            def create_archive(files, force=False):
+                # up to date, but older than the archive
+                set_mtime(manifest, (input_mtime + output_mtime) // 2)
+                set_mtime(archive, output_mtime)
+                create_combine_archive(
+                    zipfile_name="HH_example",
+                    rootfile=td + "/HH_example_cell.nml",
+                    filelist=files,
+                    force=force,
+                )
+                return archive.stat().st_mtime_ns != output_mtime
 
-        thispath = pathlib.Path(__file__)
-        filelist = []
-        dirname = str(thispath.parent.parent)
-        create_combine_archive(
-            zipfile_name="HH_example",
-            rootfile=dirname + "/HH_example_cell.nml",
-            filelist=filelist,
-        )
-        self.assertTrue(pathlib.Path(dirname + "/HH_example.neux").exists())
-
-        dirname = str(thispath.parent.parent.parent)
-        filelist = []
-        create_combine_archive(
-            zipfile_name="LEMS_NML2_Ex5_DetCell",
-            rootfile=dirname + "/examples/LEMS_NML2_Ex5_DetCell.xml",
-            filelist=filelist,
-        )
-        self.assertTrue(
-            pathlib.Path(dirname + "/examples/LEMS_NML2_Ex5_DetCell.neux").exists()
-        )
-
-        dirname = str(thispath.parent.parent.parent)
-        filelist = []
-        create_combine_archive(
-            zipfile_name="NML2_SingleCompHHCell",
-            rootfile=dirname + "/examples/NML2_SingleCompHHCell.nml",
-            filelist=filelist,
-        )
-        self.assertTrue(
-            pathlib.Path(dirname + "/examples/NML2_SingleCompHHCell.neux").exists()
-        )
+            create_combine_archive(
+                zipfile_name="HH_example",
+                rootfile=td + "/HH_example_cell.nml",
+                filelist=[],
+            )
+            self.assertFalse(create_archive([]))
+            self.assertTrue(create_archive([], force=True))
+            self.assertTrue(create_archive(filelist[:-1]))
+            self.assertTrue(create_archive([]))
+            os.utime(inputs[-1])
+            self.assertTrue(create_archive([]))
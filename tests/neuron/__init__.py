@@ -9,19 +9,18 @@ Copyright 2023 NeuroML contributors
 
 
 import pathlib
+import platform
 import subprocess
 
 
 from pyneuroml.neuron import load_hoc_or_python_file
 
+_TEST_DATA = pathlib.Path(__file__).resolve().parent / "test_data"
+
 
 def load_olm_cell():
     """Setup for all tests """
-    thispath = pathlib.Path(__file__)
-    dirname = str(thispath.parent / pathlib.Path("test_data"))
-    subprocess.run(["nrnivmodl", dirname + "/mods"])
-    # must be done after mod files have been compiled
-    from neuron import h
+    from neuron import h, load_mechanisms
 
     # if the template is already defined, do not re-define.
     # NEURON doesn't like it, and I cannot figure out how to "delete" an
@@ -30,7 +29,14 @@ def load_olm_cell():
         allsections = list(h.allsec())
         return allsections
     else:
-        retval = load_hoc_or_python_file(f"{dirname}/olm.hoc")
+        # NEURON loads mechanisms compiled in the working directory when it is
+        # imported: loading them again fails, so only do so if needed
+        if not h.name_declared("KvAolm"):
+            compile_mods(_TEST_DATA / "mods")
+            # must be done after mod files have been compiled, and before the
+            # cell that uses them is loaded
+            load_mechanisms(str(_TEST_DATA))
+        retval = load_hoc_or_python_file(str(_TEST_DATA / "olm.hoc"))
         if retval:
             h("objectvar acell")
             h("acell = new olm()")
@@ -38,3 +44,42 @@ def load_olm_cell():
 
             return allsections
     return []
+
+
+def compile_mods(mods_dir: pathlib.Path):
+    """Compile mod files, unless the compiled library is newer than all of them.
+
+    nrnivmodl is run in the parent directory of the mod file directory, where
+    it places its output in an architecture specific directory.
+
+    :param mods_dir: directory holding the mod files
+    :type mods_dir: pathlib.Path
+    :raises ValueError: if there are no mod files in the directory
+    :raises RuntimeError: if nrnivmodl fails, with its output
+    """
+    archdir = mods_dir.parent / platform.machine()
+    libs = [
+        archdir / "libnrnmech.so",
+        archdir / "libnrnmech.dylib",
+        archdir / ".libs" / "libnrnmech.so",
+    ]
+    newest_mod = max(
+        (m.stat().st_mtime for m in mods_dir.glob("*.mod")), default=None
+    )
+    if newest_mod is None:
+        raise ValueError(f"No mod files found in {mods_dir}")
+    for lib in libs:
+        if lib.exists() and lib.stat().st_mtime >= newest_mod:
+            return
+
+    result = subprocess.run(
+        ["nrnivmodl", str(mods_dir)],
+        cwd=str(mods_dir.parent),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"nrnivmodl failed with exit code {result.returncode}:\n"
+            f"{result.stdout}\n{result.stderr}"
+        )
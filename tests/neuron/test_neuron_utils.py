@@ -9,16 +9,20 @@ Copyright 2023 NeuroML contributors
 
 
 import unittest
+import json
 import logging
-import tempfile
 import pytest
 import pathlib
+import tempfile
+import typing
+from unittest import mock
 
 
+import pyneuroml.neuron
 from pyneuroml.neuron import (load_hoc_or_python_file, morphinfo,
                               get_utils_hoc, getinfo, export_mod_to_neuroml2)
 
-from . import load_olm_cell
+from . import _TEST_DATA, load_olm_cell
 
 
 logger = logging.getLogger(__name__)
@@ -29,70 +33,112 @@ class TestNeuronUtils(unittest.TestCase):
 
     """Test Neuron Utils"""
 
+    allsections = None  # type: typing.Optional[typing.List[typing.Any]]
+    _all_info = None  # type: typing.Optional[typing.Dict[str, typing.Any]]
+    _morph = None  # type: typing.Optional[typing.Dict[str, typing.Any]]
+    _default_morph = None  # type: typing.Optional[typing.Dict[str, typing.Any]]
+
+    @classmethod
+    def load_olm_info(cls):
+        """Load the olm cell and get its information once for all tests.
+
+        Not done in a class level setup because loading the cell must only
+        happen in tests marked localonly.
+        """
+        if cls.allsections is None:
+            cls.allsections = load_olm_cell()
+            cls._all_info = getinfo(cls.allsections, doprint=None)
+
+            # must be first: uses the currently accessed section
+            cls._default_morph = morphinfo(doprint=None)
+            cls._morph = {
+                sec.name(): morphinfo(sec.name(), doprint=None)
+                for sec in cls.allsections
+            }
+
     def test_hoc_loader(self):
         """Test hoc loader util function"""
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".hoc") as f:
-            print(
-                """
+        self.assertTrue(
+            load_hoc_or_python_file(
+                source="""
                 print "Empty test hoc file"
-                """,
-                file=f,
-                flush=True,
+                """
             )
+        )
 
-            self.assertTrue(load_hoc_or_python_file(f.name))
-
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".hoc") as f:
-            print(
-                """
+        self.assertFalse(
+            load_hoc_or_python_file(
+                source="""
                 a line that should cause a syntax error
-                """,
-                file=f,
-                flush=True,
+                """
             )
-
-            self.assertFalse(load_hoc_or_python_file(f.name))
+        )
 
         # loading python files is not yet implemented
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".py") as f:
-            print(
-                """
-                print("An empty test python file")
-                """,
-                file=f,
-                flush=True,
-            )
+        self.assertFalse(load_hoc_or_python_file(__file__))
+
+        with self.assertRaises(ValueError):
+            load_hoc_or_python_file()
 
-            self.assertFalse(load_hoc_or_python_file(f.name))
+        with self.assertRaises(ValueError):
+            load_hoc_or_python_file(__file__, source="print 1")
+
+        # files are run again each time they are loaded
+        h = pyneuroml.neuron.h
+        h("test_hoc_loader_count = 0")
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".hoc") as f:
+            print("test_hoc_loader_count += 1", file=f, flush=True)
+            self.assertTrue(load_hoc_or_python_file(f.name))
+            self.assertTrue(load_hoc_or_python_file(f.name))
+        self.assertEqual(h.test_hoc_loader_count, 2)
 
     def test_get_utils_hoc(self):
         """Test the get_utils_hoc function"""
         a = get_utils_hoc()
         self.assertTrue(a.is_file())
 
+    def test_load_utils_hoc(self):
+        """Test that utils.hoc is only loaded once"""
+        loader = mock.Mock(wraps=load_hoc_or_python_file)
+        with mock.patch.object(pyneuroml.neuron, "_utils_hoc_loaded", False):
+            with mock.patch.object(pyneuroml.neuron, "load_hoc_or_python_file", loader):
+                self.assertTrue(pyneuroml.neuron._load_utils_hoc())
+                self.assertTrue(pyneuroml.neuron._load_utils_hoc())
+        loader.assert_called_once_with(str(get_utils_hoc().absolute()))
+
     @pytest.mark.localonly
     def test_morphinfo(self):
         """Test the morphinfo function"""
-        if not hasattr(self, 'allsections'):
-            self.allsections = load_olm_cell()
+        self.load_olm_info()
         self.assertGreater(len(self.allsections), 0)
         logger.debug(f"All sections are: {self.allsections}")
         # default section is soma_0
-        soma_morph = morphinfo(doprint="json")
+        self.assertEqual(self._default_morph["name"], "olm[0].soma_0")
+        self.assertEqual(self._default_morph, self._morph["olm[0].soma_0"])
+        soma_morph = self._morph["olm[0].soma_0"]
         self.assertEqual(soma_morph["nsegs"], 1)
         self.assertEqual(soma_morph["n3d"], 3)
         self.assertEqual(soma_morph["3d points"][0]["diam"], 10.0)
         self.assertEqual(soma_morph["3d points"][1]["diam"], 10.0)
         self.assertEqual(soma_morph["3d points"][2]["diam"], 10.0)
 
-        axon_morph = morphinfo("olm[0].axon_0", doprint="json")
+        axon_morph = self._morph["olm[0].axon_0"]
         self.assertEqual(axon_morph["nsegs"], 1)
         self.assertEqual(axon_morph["n3d"], 3)
         self.assertEqual(axon_morph["3d points"][0]["diam"], 1.5)
         self.assertEqual(axon_morph["3d points"][1]["y"], -75.0)
         self.assertEqual(axon_morph["3d points"][2]["y"], -150.0)
 
-        dend_morph = morphinfo("olm[0].dend_0", doprint="json")
+        # the printed json has the same information as the returned dict
+        with self.assertLogs("pyneuroml.neuron", level="INFO") as cm:
+            axon_morph_json = morphinfo("olm[0].axon_0", doprint="json")
+        self.assertEqual(axon_morph_json, axon_morph)
+        self.assertEqual(
+            json.loads(cm.records[-1].getMessage()),
+            json.loads(json.dumps(axon_morph)),
+        )
+
+        dend_morph = self._morph["olm[0].dend_0"]
         self.assertEqual(dend_morph["nsegs"], 1)
         self.assertEqual(dend_morph["n3d"], 3)
         self.assertEqual(dend_morph["3d points"][0]["diam"], 3.0)
@@ -102,39 +148,42 @@ class TestNeuronUtils(unittest.TestCase):
     @pytest.mark.localonly
     def test_getinfo(self):
         """Test the getinfo function"""
-        # compile mods
-        if not hasattr(self, 'allsections'):
-            self.allsections = load_olm_cell()
+        self.load_olm_info()
         self.assertGreater(len(self.allsections), 0)
         logger.debug(f"All sections are: {self.allsections}")
-        allinfo = getinfo(self.allsections, doprint="json")
+        allinfo = self._all_info
         logger.debug(f"Info on all sections: {allinfo}")
 
-        soma_0_KvAolm_gmax = allinfo["mechanisms"]["KvAolm"]["parameters"]["gmax_KvAolm"]["values"]["olm_0_.soma_0"]["values"]["*"]
-        self.assertEqual(soma_0_KvAolm_gmax, 0.00495)
-        soma_0_leak_gmax = allinfo["mechanisms"]["leak_chan"]["parameters"]["gmax_leak_chan"]["values"]["olm_0_.soma_0"]["values"]["*"]
-        self.assertEqual(soma_0_leak_gmax, 1E-5)
+        # (mechanism, parameter, section): value lookup table
+        flat = {
+            (m, p, s): v["values"]["*"]
+            for m, mv in allinfo["mechanisms"].items()
+            for p, pv in mv["parameters"].items()
+            for s, v in pv["values"].items()
+        }
 
-        dend_0_KvAolm_gmax = allinfo["mechanisms"]["KvAolm"]["parameters"]["gmax_KvAolm"]["values"]["olm_0_.dend_0"]["values"]["*"]
-        self.assertEqual(dend_0_KvAolm_gmax, 0.0028)
-        dend_0_leak_gmax = allinfo["mechanisms"]["leak_chan"]["parameters"]["gmax_leak_chan"]["values"]["olm_0_.dend_0"]["values"]["*"]
-        self.assertEqual(dend_0_leak_gmax, 1E-5)
+        self.assertEqual(flat[("KvAolm", "gmax_KvAolm", "olm_0_.soma_0")], 0.00495)
+        self.assertEqual(flat[("leak_chan", "gmax_leak_chan", "olm_0_.soma_0")], 1E-5)
 
-        axon_0_Nav_gmax = allinfo["mechanisms"]["Nav"]["parameters"]["gmax_Nav"]["values"]["olm_0_.axon_0"]["values"]["*"]
-        self.assertEqual(axon_0_Nav_gmax, 0.01712)
+        self.assertEqual(flat[("KvAolm", "gmax_KvAolm", "olm_0_.dend_0")], 0.0028)
+        self.assertEqual(flat[("leak_chan", "gmax_leak_chan", "olm_0_.dend_0")], 1E-5)
 
-        axon_0_leak_gmax = allinfo["mechanisms"]["leak_chan"]["parameters"]["gmax_leak_chan"]["values"]["olm_0_.axon_0"]["values"]["*"]
-        self.assertEqual(axon_0_leak_gmax, 1E-5)
+        self.assertEqual(flat[("Nav", "gmax_Nav", "olm_0_.axon_0")], 0.01712)
+        self.assertEqual(flat[("leak_chan", "gmax_leak_chan", "olm_0_.axon_0")], 1E-5)
+
+        flatinfo = getinfo(self.allsections, doprint=None, layout="flat")
+        self.assertEqual(
+            flatinfo[("KvAolm", "gmax_KvAolm", "olm_0_.soma_0", "*")], 0.00495
+        )
+        # all parameters of the olm cell are uniform over their sections
+        self.assertEqual(len(flatinfo), len(flat))
 
     def test_export_mod_to_neuroml2(self):
         """Test the export_mod_to_neuroml2 method."""
-        thispath = pathlib.Path(__file__)
-        dirname = str(thispath.parent / pathlib.Path("test_data") / pathlib.Path("mods"))
-
-        export_mod_to_neuroml2(str(dirname) + "/leak_chan.mod")
+        export_mod_to_neuroml2(str(_TEST_DATA / "mods" / "leak_chan.mod"))
         path = pathlib.Path("leak_chan.channel.nml")
         self.assertTrue(path.is_file())
 
-        export_mod_to_neuroml2(str(dirname) + "/Nav.mod")
+        export_mod_to_neuroml2(str(_TEST_DATA / "mods" / "Nav.mod"))
         path = pathlib.Path("Nav.channel.nml")
         self.assertTrue(path.is_file())